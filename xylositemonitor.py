@@ -3,16 +3,24 @@
 import sys
 import os
 import re
-from io import BytesIO
 import argparse
 import time
 import traceback
 import socket
+import threading
 
 import yaml
+try:
+    # the libyaml C loader parses much faster than the pure-Python one
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 import pycurl  # pycurl is annoyingly low-level but the easier
                # "requests" module does not allow forcing IP version
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
 from datetime import datetime, timedelta, timezone
 import OpenSSL
 import ssl
@@ -39,6 +47,10 @@ class HeaderException(Exception):
     """Problem parsing the headers."""
     pass
 
+class ConfigException(Exception):
+    """Fatal problem with the sites config."""
+    pass
+
 # don't even try to open sitesfile unless it's there
 if not os.path.isfile(sitesfile):
     print('Initialisation Error! Cannot find sitesfile at "' + sitesfile +
@@ -50,12 +62,20 @@ def destructure(dictionary, *keys):
     return (dictionary[key] for key in keys)
 
 with open(sitesfile, 'r') as stream:
-    loaded = yaml.safe_load(stream)
+    loaded = yaml.load(stream, Loader=YamlLoader)
     options, sites = destructure(loaded, 'options', 'sites')
 
     # specific options
     exweeks = options['cert expiry weeks']
 
+# index the sites by name once so re-tests don't scan the whole list
+sites_by_name = {site["name"]: site for site in sites}
+
+# certificates expiring before this moment fail the expiry test; one run is
+# short enough that capturing "now" once at startup is plenty accurate for a
+# weeks-away comparison
+CERT_CUTOFF = datetime.now(timezone.utc) + timedelta(weeks=exweeks)
+
 def send_mail(subject, mail_body):
     """send the mail"""
     import smtplib
@@ -85,40 +105,57 @@ def handle_unhandled_exception(exc_type, exc_value, exc_traceback):
 
 sys.excepthook = handle_unhandled_exception
 
-def header_function(headers, header_line):
-    """We have to parse http headers manually becasue libcurl doesn't do it for us."""
-
-    # HTTP standard specifies that headers are encoded in iso-8859-1.
-    header_line = header_line.decode('iso-8859-1')
-
-    # Header lines include the first status line (HTTP/1.x ...).
-    if re.search(r'\AHTTP/[123456789]', header_line[:6]):
-        # get status code
-        status = re.search(r'[0123456789]{3}', header_line).group(0)
-        headers['status'] = status
-        return
-
-    # We are going to ignore all lines that don't have a colon in them.
-    # This will botch headers that are split on multiple lines...
-    if ':' not in header_line:
-        return
-
-    # Break the header line into header name and value.
-    hname, value = header_line.split(':', 1)
-
-    # Remove whitespace that may be present.
-    # Header lines include the trailing newline, and there may be whitespace
-    # around the colon.
-    hname = hname.strip()
-    value = value.strip()
-
-    # Header names are case insensitive.
-    # Lowercase name here.
-    hname = hname.lower()
-
-    # Now we can actually record the header name and value.
-    # Note: this only works when headers are not duplicated, see below.
-    headers[hname] = value
+# compiled once up-front; this runs on every response, and going through
+# re.search() each time pays a cache lookup
+CHARSET_RE = re.compile(r'charset=(\S+)')
+
+# shared prefix tuple for startswith checks so it isn't rebuilt per call
+URL_PREFIXES = ("http://", "https://")
+
+def is_nonempty_str(x):
+    """check a config value is a string with something in it"""
+    return isinstance(x, str) and x.strip() != ""
+
+class HeaderSink:
+    """We have to parse http headers manually becasue libcurl doesn't do it
+    for us. libcurl calls this object once per header line, so rather than
+    allocating a closure per request we make the instance itself callable and
+    collect the headers on an attribute."""
+
+    __slots__ = ("headers",)
+
+    def __init__(self):
+        self.headers = {}
+
+    def __call__(self, header_line):
+        # We work in bytes all the way through and only decode the short
+        # tokens we actually keep; strip/lower/partition on bytes are each a
+        # single pass in C.
+
+        # Header lines include the first status line (HTTP/1.x ...).
+        if header_line.startswith(b'HTTP/'):
+            # the status code is the three digits after the first space
+            # (works for "HTTP/1.1 200 OK" and "HTTP/2 200" alike)
+            _, _, rest = header_line.partition(b' ')
+            self.headers['status'] = rest[:3].decode('ascii')
+            return
+
+        # Break the header line into header name and value. We are going to
+        # ignore all lines that don't have a colon in them.
+        # This will botch headers that are split on multiple lines...
+        hname, sep, value = header_line.partition(b':')
+        if not sep:
+            return
+
+        # Header lines include the trailing newline, there may be whitespace
+        # around the colon, and header names are case insensitive so we
+        # lowercase them. HTTP standard specifies headers are iso-8859-1.
+        hname = hname.strip().lower().decode('iso-8859-1')
+        value = value.strip().decode('iso-8859-1')
+
+        # Now we can actually record the header name and value.
+        # Note: this only works when headers are not duplicated, see below.
+        self.headers[hname] = value
 
 BCOLORS = {
     "HEADER": '\033[95m',
@@ -140,193 +177,238 @@ def config_fail(message):
 
         send_mail('config error!', mail_body)
 
-    sys.exit()
+    # raise rather than sys.exit() so a bad site doesn't strand the worker
+    # threads; the top-level handler does the actual exit
+    raise ConfigException(message)
+
+# slotted dataclasses rather than dicts for the results: we make one per test
+# and per site, and attribute access on slots is cheaper (and tighter in
+# memory) than dict lookups
+
+@dataclass(slots=True)
+class TestResult:
+    """outcome of a single test"""
+    success: bool
+    text_body: str
+    mail_body: str
+
+@dataclass(slots=True)
+class SiteResult:
+    """outcome of all of one site's tests"""
+    name: str
+    tests: list
+    success_count: int = 0
+    fail_count: int = 0
 
 def test_fail(message):
-    return {
-        "success": False,
-        "text_body": BCOLORS["FAIL"] + "  Test Fail! " + message + BCOLORS["ENDC"] + "\n",
-        "mail_body": "  Test Fail! " + message + "\n"
-    }
+    return TestResult(
+        success=False,
+        text_body=BCOLORS["FAIL"] + "  Test Fail! " + message + BCOLORS["ENDC"] + "\n",
+        mail_body="  Test Fail! " + message + "\n"
+    )
 
 
 def test_success():
-    return {
-        "success": True,
-        "text_body": BCOLORS["OKGREEN"] + " Test Success!" + BCOLORS["ENDC"] + "\n",
-        "mail_body": " Test Success!" + "\n"
-    }
-
-
-mail_body = ""
-
-def call_curl(prefix, url, curliptype):
-    buffer = BytesIO()
-    c = pycurl.Curl()
+    return TestResult(
+        success=True,
+        text_body=BCOLORS["OKGREEN"] + " Test Success!" + BCOLORS["ENDC"] + "\n",
+        mail_body=" Test Success!" + "\n"
+    )
+
+
+# each worker thread keeps one curl handle and reuses it for every request it
+# makes; a reused handle lets libcurl keep its connection cache, so TCP
+# connections, TLS sessions and DNS lookups get shared between the several
+# probes we make against the same host
+threadlocal = threading.local()
+
+def get_curl():
+    """fetch this thread's curl handle, creating it on first use"""
+    curl = getattr(threadlocal, 'curl', None)
+    if curl is None:
+        curl = pycurl.Curl()
+        threadlocal.curl = curl
+    # reset() clears the options from the previous call but, unlike close(),
+    # keeps the connection cache alive
+    curl.reset()
+    return curl
+
+def call_curl(prefix, url, curliptype, fetch_body=True):
+    c = get_curl()
     c.setopt(c.URL, prefix + url)
     c.setopt(c.FOLLOWLOCATION, False)
     c.setopt(c.TIMEOUT, 8)
     c.setopt(c.ACCEPT_ENCODING, "")
     c.setopt(c.USERAGENT, "xylositemonitor")
     c.setopt(c.IPRESOLVE, curliptype)
-    c.setopt(c.WRITEFUNCTION, buffer.write)
 
-    # we give curl a function to call which modifies our variable
-    headers = {}
-    c.setopt(c.HEADERFUNCTION, lambda x: header_function(headers, x))
+    buffer = bytearray()
+    if fetch_body:
+        # libcurl appends response chunks straight into the bytearray; unlike
+        # BytesIO there's no extra buffer object and no getvalue() copy
+        c.setopt(c.WRITEFUNCTION, buffer.extend)
+    else:
+        # callers that only look at headers get a HEAD request; the status
+        # line and headers (including Location) still come back, but we skip
+        # downloading the whole body
+        c.setopt(c.NOBODY, 1)
+
+    # make sure connection reuse is on (these are the defaults, but we're
+    # explicit since the whole point of reusing the handle is to get it)
+    c.setopt(c.FORBID_REUSE, 0)
+    c.setopt(c.FRESH_CONNECT, 0)
+
+    # we give curl a callable which collects the headers on itself
+    sink = HeaderSink()
+    c.setopt(c.HEADERFUNCTION, sink)
 
-    # call curl
+    # call curl (no close() afterwards; the handle belongs to the thread)
     c.perform()
-    c.close()
+    headers = sink.headers
 
     # Figure out what encoding was sent with the response, if any.
     # Check against lowercased header name.
     encoding = None
     if 'content-type' in headers:
         content_type = headers['content-type'].lower()
-        match = re.search(r'charset=(\S+)', content_type)
+        match = CHARSET_RE.search(content_type)
         if match:
             encoding = match.group(1)
     if encoding is None:
         # Default encoding for HTML is iso-8859-1
         encoding = 'iso-8859-1'
 
-    body = buffer.getvalue()
-    responsebody = body.decode(encoding)
-
     if 'status' not in headers:
         raise HeaderException("Can't get HTTP response code!")
 
-    return (headers, responsebody)
+    # the body stays as bytes; most actions never look at it, so decoding
+    # is left to the handler that actually needs to
+    return (headers, buffer, encoding)
+
+# There are three supported actions to test for, each implemented by a
+# handler below
+# http success
+#     this just tests for 200 status
+# return string
+#     this checks for 200 and the contents of the page for an expected string
+# redirect
+#     this checks that the status is a redirect code to the specified URL
+
+def action_http_success(headers, body, encoding, spec):
+    if headers['status'] != "200":
+        return test_fail("HTTP status is: " + headers['status'])
+    else:
+        return test_success()
 
-def perform_test(prefix, url, action, ex_string, can_address, curliptype):
+def action_return_string(headers, body, encoding, spec):
+    # just check at least the status is 200 before even checking string
+    if headers['status'] != "200":
+        return test_fail("HTTP status is: " + headers['status'])
+
+    # now we grep for the expected string in the response body. encoding the
+    # (short) needle and searching the raw bytes beats decoding the whole body
+    if not spec.ex_string.encode(encoding) in body:
+        return test_fail("Don't find expected string!")
+    else:
+        return test_success()
+
+def action_redirect(headers, body, encoding, spec):
+    if not headers['status'].startswith("3"):
+        return test_fail("Response code is not a redirect: " + headers['status'])
+
+    if 'location' not in headers:
+        return test_fail("Response code is a redirect but no Location header!")
+
+    # Follow redirects until we reach the final destination
+    redirect_url = headers['location']
+    max_redirects = 3  # Limit to 3 redirects
+    redirect_chain = [redirect_url]
+
+    # Follow the redirect chain
+    while max_redirects > 0 and redirect_url.startswith(URL_PREFIXES):
+        try:
+            # Parse the URL to determine protocol and url
+            if redirect_url.startswith('https://'):
+                next_prefix = 'https://'
+                next_url = redirect_url[8:]
+            else:  # http://
+                next_prefix = 'http://'
+                next_url = redirect_url[7:]
+
+            # Call curl for the next URL in the chain
+            next_headers, _, _ = call_curl(next_prefix, next_url, spec.curliptype,
+                                           fetch_body=False)
+
+            # Check if we've reached the end of the redirect chain
+            if not next_headers['status'].startswith("3") or 'location' not in next_headers:
+                break
+
+            redirect_url = next_headers['location']
+            redirect_chain.append(redirect_url)
+            max_redirects -= 1
+        except (pycurl.error, HeaderException) as e:
+            return test_fail(f"Error following redirect chain: {str(e)}")
+
+    # Handle relative URLs in the redirect chain
+    final_url = redirect_chain[-1]
+    if not final_url.startswith(URL_PREFIXES):
+        # Resolve relative URL
+        if final_url.startswith('/'):
+            # Absolute path
+            domain = None
+            for prev_url in redirect_chain[:-1]:
+                if prev_url.startswith(URL_PREFIXES):
+                    domain = prev_url.split('/')[2]  # Get domain from previous URL
+                    scheme = 'https://' if prev_url.startswith('https://') else 'http://'
+                    final_url = f"{scheme}{domain}{final_url}"
+                    break
+            if domain is None:
+                domain = spec.url.split('/')[0]
+                final_url = f"{spec.prefix}{domain}{final_url}"
+        else:
+            # Relative path - use last URL as base
+            if len(redirect_chain) > 1:
+                base_url = redirect_chain[-2]
+                final_url = f"{'/'.join(base_url.split('/')[:-1])}/{final_url}"
+
+    # now we check the final redirect location
+    if not final_url == spec.can_address:
+        return test_fail(f"Final redirect location is wrong: {final_url} (expected {spec.can_address})")
+    else:
+        return test_success()
+
+# the handler is looked up here once at plan-build time, so running a test is
+# a direct call rather than a string comparison per request
+ACTION_HANDLERS = {
+    "http success": action_http_success,
+    "return string": action_return_string,
+    "redirect": action_redirect,
+}
+
+def perform_test(spec):
     """
-    we return a dictionary like
-      {"success": True, "text_body": "blah", "mail_body": "blah"}
+    we return a TestResult
     """
 
     try:
-        headers, responsebody = call_curl(prefix, url, curliptype)
+        # only the "return string" action inspects the body, so everything
+        # else gets away with a HEAD request
+        headers, body, encoding = call_curl(spec.prefix, spec.url, spec.curliptype,
+                                            fetch_body=(spec.action == "return string"))
     except (pycurl.error, HeaderException) as e:
         return test_fail(str(e))
 
-    # There are three supported actions to test for
-    # http success
-    #     this just tests for 200 status
-    # return string
-    #     this checks for 200 and the contents of the page for an expected string
-    # redirect
-    #     this checks that the status is a redirect code to the specified URL
-    match action:
-        case "http success":
-            if headers['status'] != "200":
-                return test_fail("HTTP status is: " + headers['status'])
-            else:
-                return test_success()
-
-        case "return string":
-            # just check at least the status is 200 before even checking string
-            if headers['status'] != "200":
-                return test_fail("HTTP status is: " + headers['status'])
-
-            # we need ex_string var for this test
-            try:
-                re.search('[a-zA-Z0-9]+', ex_string).group(0)  # this will error
-                                                               # on both blank
-                                                               # string and
-                                                               # non-string
-            except (TypeError, AttributeError):
-                config_fail('"return string" check specified but ' +
-                            '"expected string" is not defined!')
-
-            # now we grep for the expected string in the response body
-            if not ex_string in responsebody:
-                return test_fail("Don't find expected string!")
-            else:
-                return test_success()
-
-        case "redirect":
-            if headers['status'][:1] != "3":
-                return test_fail("Response code is not a redirect: " +headers['status'])
-
-            if 'location' not in headers:
-                return test_fail("Response code is a redirect but no Location header!")
-            
-            # we need can_address var for this test
-            try:
-                re.search('[a-zA-Z0-9]+', can_address).group(0) # this will
-                                                                # error on both
-                                                                # blank string
-                                                                # and non-string
-            except (TypeError, AttributeError):
-                config_fail('"redirect" check specified but ' +
-                            '"canonical address" is not defined!')
-            
-            # Follow redirects until we reach the final destination
-            redirect_url = headers['location']
-            max_redirects = 3  # Limit to 3 redirects
-            redirect_chain = [redirect_url]
-            
-            # Follow the redirect chain
-            while max_redirects > 0 and redirect_url.startswith(('http://', 'https://')):
-                try:
-                    # Parse the URL to determine protocol and url
-                    if redirect_url.startswith('https://'):
-                        next_prefix = 'https://'
-                        next_url = redirect_url[8:]
-                    else:  # http://
-                        next_prefix = 'http://'
-                        next_url = redirect_url[7:]
-                    
-                    # Call curl for the next URL in the chain
-                    next_headers, _ = call_curl(next_prefix, next_url, curliptype)
-                    
-                    # Check if we've reached the end of the redirect chain
-                    if next_headers['status'][:1] != "3" or 'location' not in next_headers:
-                        break
-                    
-                    redirect_url = next_headers['location']
-                    redirect_chain.append(redirect_url)
-                    max_redirects -= 1
-                except (pycurl.error, HeaderException) as e:
-                    return test_fail(f"Error following redirect chain: {str(e)}")
-            
-            # Handle relative URLs in the redirect chain
-            final_url = redirect_chain[-1]
-            if not final_url.startswith(('http://', 'https://')):
-                # Resolve relative URL
-                if final_url.startswith('/'):
-                    # Absolute path
-                    domain = None
-                    for prev_url in redirect_chain[:-1]:
-                        if prev_url.startswith(('http://', 'https://')):
-                            domain = prev_url.split('/')[2]  # Get domain from previous URL
-                            scheme = 'https://' if prev_url.startswith('https://') else 'http://'
-                            final_url = f"{scheme}{domain}{final_url}"
-                            break
-                    if domain is None:
-                        domain = url.split('/')[0]
-                        final_url = f"{prefix}{domain}{final_url}"
-                else:
-                    # Relative path - use last URL as base
-                    if len(redirect_chain) > 1:
-                        base_url = redirect_chain[-2]
-                        final_url = f"{'/'.join(base_url.split('/')[:-1])}/{final_url}"
-
-            # now we check the final redirect location
-            if not final_url == can_address:
-                return test_fail(f"Final redirect location is wrong: {final_url} (expected {can_address})")
-            else:
-                return test_success()
-
-        case _:
-            # if we got here it means we didn't recognise the action
-            config_fail('action not recognised!')
+    return spec.handler(headers, body, encoding, spec)
+
+# expiry dates of certificates we've already fetched this run, keyed on
+# domain. a site with several urls on one domain only costs us one TLS
+# handshake. worst case two threads race and fetch the same cert twice,
+# which is harmless
+cert_cache = {}
 
 def cert_test(url):
     """
-    we return a dictionary like
-      {"success": True, "text_body": "blah", "mail_body": "blah"}
+    we return a TestResult
     """
 
     # we need to get the domain from the url
@@ -335,16 +417,17 @@ def cert_test(url):
     # If it's https we check the certificate date before doing anything else
     # note this doesn't care about ipv4 vs 6 as it connects by hostname
     try:
-        cert=ssl.get_server_certificate((domain, 443), timeout=8)  # it takes a tuple
-        x509 = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
-        timestamp = x509.get_notAfter().decode('utf-8')
-        etime = datetime.strptime(timestamp, '%Y%m%d%H%M%S%z')
+        if domain in cert_cache:
+            etime = cert_cache[domain]
+        else:
+            cert=ssl.get_server_certificate((domain, 443), timeout=8)  # it takes a tuple
+            x509 = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
+            timestamp = x509.get_notAfter().decode('utf-8')
+            etime = datetime.strptime(timestamp, '%Y%m%d%H%M%S%z')
+            cert_cache[domain] = etime
 
         # now to compare
-        delta_weeks = timedelta(weeks=exweeks)
-        now = datetime.now(timezone.utc)
-
-        if etime - now < delta_weeks:
+        if etime < CERT_CUTOFF:
             result = test_fail("certificate expires in " + etime.date().isoformat())
         else:
             result = test_success()
@@ -353,36 +436,43 @@ def cert_test(url):
 
     # prepend test description
     prepend = f'does "{domain}" have at-least {exweeks} weeks before cert expiry?'
-    result["mail_body"] = prepend + "\n" + result["mail_body"]
-    result["text_body"] = prepend + "\n" + result["text_body"]
+    result.mail_body = prepend + "\n" + result.mail_body
+    result.text_body = prepend + "\n" + result.text_body
 
     return result
 
-def test_summary(protocol, url, action, ex_string, can_address, curliptype, ipver):
+def test_summary(spec):
     """since the perform_test function has multiple exit-points, we need to
     collect it's output and summarize what it means"""
 
-    if protocol == "TLS":
-        prefix = "https://"
-    elif protocol == "no-TLS":
-        prefix = "http://"
-
     # here we actually run the tests
-    result = perform_test(prefix, url, action, ex_string, can_address,
-                          curliptype)
+    result = perform_test(spec)
 
     # prepend test description
-    prepend = f'{ipver}, does "{url}" {action} over "{protocol}"?'
-    result["mail_body"] = prepend + "\n" + result["mail_body"]
-    result["text_body"] = prepend + "\n" + result["text_body"]
+    prepend = f'{spec.ipver}, does "{spec.url}" {spec.action} over "{spec.protocol}"?'
+    result.mail_body = prepend + "\n" + result.mail_body
+    result.text_body = prepend + "\n" + result.text_body
 
     return result
 
-def test_site(site):
-    """
-    we return a dictionary like
-      {"name": "Site Name", "success_count": 4, "fail_count": 2, "tests": []}
-    """
+@dataclass(slots=True)
+class TestSpec:
+    """one fully-validated test, ready to run. kind is "cert" or "curl";
+    cert tests only use the url field"""
+    kind: str
+    url: str
+    protocol: str = ""
+    prefix: str = ""
+    action: str = ""
+    ex_string: str = ""
+    can_address: str = ""
+    curliptype: int = 0
+    ipver: str = ""
+    handler: object = None  # one of the ACTION_HANDLERS functions
+
+def build_site_plan(site):
+    """expand one site's config into a flat list of TestSpecs, doing all the
+    config validation once here rather than once per probe"""
 
     # get method allows us to have default value
     ex_string = site.get("expected string", "")
@@ -390,8 +480,6 @@ def test_site(site):
     testipv4 = site.get("ipv4", True)
     testipv6 = site.get("ipv6", True)
 
-    acc = {"name": site["name"], "tests": []}
-
     # rather than using four levels of nested loop, we are flattening it using a
     # mind-boggling list comprehension instead
     urls_flattened = [
@@ -405,66 +493,123 @@ def test_site(site):
         for protocol in test["protocols"]
     ]
 
+    plan = []
+    seen_cert_domains = set()
+
     for test in urls_flattened:
         url, action, protocol = destructure(test, "url", "action", "protocol")
 
-        if url[:7] == "http://" or url[:8] == "https://":
+        if url.startswith(URL_PREFIXES):
             config_fail('Do not specify protocol in url.')
 
         if not protocol in ("TLS", "no-TLS"):
             config_fail('Supported protocols are "TLS" and "no-TLS".')
 
+        if not action in ACTION_HANDLERS:
+            config_fail('action not recognised!')
+        handler = ACTION_HANDLERS[action]
+
+        if action == "return string" and not is_nonempty_str(ex_string):
+            config_fail('"return string" check specified but ' +
+                        '"expected string" is not defined!')
+
+        if action == "redirect" and not is_nonempty_str(can_address):
+            config_fail('"redirect" check specified but ' +
+                        '"canonical address" is not defined!')
+
+        prefix = "https://" if protocol == "TLS" else "http://"
+
         if exweeks > 0 and protocol == "TLS" and not skipssl:
-            # do an extra test
-            acc["tests"] += [cert_test(url)]
+            # do an extra test, but only once per domain: several urls on the
+            # same domain share a certificate, and repeating it just pads the
+            # report with identical rows
+            domain = url.split('/')[0]
+            if domain not in seen_cert_domains:
+                seen_cert_domains.add(domain)
+                plan += [TestSpec("cert", url)]
 
         if testipv4:
-            acc["tests"] += [test_summary(protocol, url, action, ex_string,
-                                              can_address, pycurl.IPRESOLVE_V4,
-                                              "IPv4")]
+            plan += [TestSpec("curl", url, protocol, prefix, action, ex_string,
+                              can_address, pycurl.IPRESOLVE_V4, "IPv4", handler)]
 
         if testipv6:
-            acc["tests"] += [test_summary(protocol, url, action, ex_string,
-                                              can_address, pycurl.IPRESOLVE_V6,
-                                              "IPv6")]
+            plan += [TestSpec("curl", url, protocol, prefix, action, ex_string,
+                              can_address, pycurl.IPRESOLVE_V6, "IPv6", handler)]
+
+    return plan
 
-    acc["success_count"] = [test["success"] for test in acc["tests"]].count(True)
-    acc["fail_count"]    = [test["success"] for test in acc["tests"]].count(False)
+def run_spec(spec):
+    """run a single spec from a site's plan"""
+    if spec.kind == "cert":
+        return cert_test(spec.url)
+    else:
+        return test_summary(spec)
+
+# a second, shared pool for the individual tests within a site, so a site
+# with many urls doesn't run its probes one after another. it has to be
+# separate from the sites pool: if test_site submitted back into its own
+# pool the workers could all end up waiting on each other
+spec_executor = ThreadPoolExecutor(max_workers=64)
+
+def test_site(site):
+    """
+    we return a SiteResult
+    """
+
+    acc = SiteResult(name=site["name"], tests=[])
+
+    # the plan was validated and flattened up-front; just run it. map keeps
+    # the results in plan order even though they run concurrently
+    acc.tests = list(spec_executor.map(run_spec, siteplans[site["name"]]))
+
+    # count successes in one pass; failures are just the remainder
+    acc.success_count = sum(1 for test in acc.tests if test.success)
+    acc.fail_count    = len(acc.tests) - acc.success_count
 
     return acc
 
 def check_result(site):
     """if the site has any failed tests, re-test it"""
-    if site["fail_count"] == 0:
+    if site.fail_count == 0:
         return site
     else:
-        # here we need to get the original data out of global variable "sites"
-        # to test it again
-        return test_site([x for x in sites if x["name"] == site["name"]][0])
-
-# this is a list of dicts
-siteresults = [test_site(site) for site in sites]
-
-# any that failed will be re-tested
-restest_total = len([x for x in siteresults if x["fail_count"] != 0])
-
-if restest_total > 0:
-    time.sleep(10)
-    siteresults = [check_result(site) for site in siteresults]
+        # look the original site config up by name to test it again
+        return test_site(sites_by_name[site.name])
+
+# every test spends nearly all of its time blocked on the network, so we run
+# the sites through a thread pool rather than one-at-a-time
+try:
+    # expand every site's config into its test plan before any network work;
+    # this is also where all the config validation happens
+    siteplans = {site["name"]: build_site_plan(site) for site in sites}
+
+    # this is a list of dicts
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        siteresults = list(executor.map(test_site, sites))
+
+    # any that failed will be re-tested
+    restest_total = len([x for x in siteresults if x.fail_count != 0])
+
+    if restest_total > 0:
+        time.sleep(10)
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            siteresults = list(executor.map(check_result, siteresults))
+except ConfigException:
+    sys.exit()
 
 # sort the sites based on success
-siteresultssorted = sorted(siteresults, key=lambda x: x["fail_count"], reverse=True)
+siteresultssorted = sorted(siteresults, key=lambda x: x.fail_count, reverse=True)
 
-success_total = sum([site["success_count"] for site in siteresults])
-fail_total    = sum([site["fail_count"]    for site in siteresults])
+success_total = sum([site.success_count for site in siteresults])
+fail_total    = sum([site.fail_count    for site in siteresults])
 
 if not mailto:
     for site in siteresultssorted:
-        print("_" + site["name"] + "_")
+        print("_" + site.name + "_")
         print("")
 
-        for test in site["tests"]:
-            print(test["text_body"])
+        for test in site.tests:
+            print(test.text_body)
 
         print("")
 
@@ -475,19 +620,25 @@ if not mailto:
     print(str(restest_total) + " sites re-tested")
 
 else:
+    # collect the pieces in a list and join once at the end, rather than
+    # growing a string with += which re-copies it every time
+    parts = []
+
     for site in siteresultssorted:
-        mail_body += "_" + site["name"] + "_\n\n"
+        parts += ["_" + site.name + "_\n\n"]
+
+        for test in site.tests:
+            parts += [test.mail_body + "\n"]
 
-        for test in site["tests"]:
-            mail_body += test["mail_body"] + "\n"
+        parts += ["\n"]
 
-        mail_body += "\n"
+    parts += ["\n"]
+    parts += ["Summary:\n"]
+    parts += [str(success_total) + " tests passed\n"]
+    parts += [str(fail_total) + " tests failed\n"]
+    parts += [str(restest_total) + " sites re-tested\n"]
 
-    mail_body += "\n"
-    mail_body += "Summary:\n"
-    mail_body += str(success_total) + " tests passed\n"
-    mail_body += str(fail_total) + " tests failed\n"
-    mail_body += str(restest_total) + " sites re-tested\n"
+    mail_body = "".join(parts)
 
     # we've got our mail body, now we just need to work out what our subject is
     if fail_total > 0: